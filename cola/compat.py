@@ -9,6 +9,12 @@ except ImportError:
     # Python 3
     from urllib import parse  # noqa
 
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2
+    from time import time as monotonic  # noqa
+
 
 PY2 = sys.version_info[0] == 2
 PY3 = sys.version_info[0] >= 3
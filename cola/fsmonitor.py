@@ -10,6 +10,7 @@ from __future__ import division, absolute_import, unicode_literals
 import errno
 import os
 import os.path
+import re
 import select
 from threading import Lock
 
@@ -18,9 +19,9 @@ from qtpy.QtCore import Signal
 
 from . import utils
 from . import core
-from . import gitcmds
 from . import version
 from .compat import bchr
+from .compat import monotonic
 from .i18n import N_
 from .interaction import Interaction
 
@@ -89,11 +90,40 @@ class _BaseThread(QtCore.QThread):
         self._force_notify = False
         self._force_config = False
         self._file_paths = set()
+        self._notify_deadline = None
 
     @property
     def _pending(self):
         return self._force_notify or self._file_paths or self._force_config
 
+    def _pending_state(self):
+        """Return a snapshot that changes when new work becomes pending"""
+        return (self._force_notify, self._force_config, len(self._file_paths))
+
+    def _schedule_notify(self, state):
+        """Delay notify() until no changes have been seen for a while
+
+        The deadline only moves when the batch handled since state was
+        taken with _pending_state() added something to notify about.
+
+        """
+        if self._pending and self._pending_state() != state:
+            delay = self._NOTIFICATION_DELAY / 1000.0
+            self._notify_deadline = monotonic() + delay
+
+    def _notify_timeout(self):
+        """Return the milliseconds remaining until notify() is due
+
+        None is returned when there is nothing to notify.  The remaining
+        time is measured against a fixed deadline so that interrupted
+        waits do not postpone the notification.
+
+        """
+        if not self._pending or self._notify_deadline is None:
+            return None
+        remaining = self._notify_deadline - monotonic()
+        return max(0, int(remaining * 1000))
+
     # pylint: disable=no-self-use
     def refresh(self):
         """Do any housekeeping necessary in response to repository changes."""
@@ -157,6 +187,16 @@ if AVAILABLE == 'inotify':
             | inotify.IN_MOVED_TO
         )
         _ADD_MASK = _TRIGGER_MASK | inotify.IN_EXCL_UNLINK | inotify.IN_ONLYDIR
+        # Only the worktree, git dir and refs dir can legitimately be
+        # symlinks.  The directories below them come from the index, from
+        # walking refs/ and from _new_worktree_dirs_to_watch(), and none of
+        # those return symlinks, so a symlink found there is not followed.
+        _NOFOLLOW_ADD_MASK = _ADD_MASK | inotify.IN_DONT_FOLLOW
+        _NEW_DIR_MASK = inotify.IN_CREATE | inotify.IN_MOVED_TO
+        # Directories only affect the status when they are added or removed
+        _DIR_TRIGGER_MASK = _NEW_DIR_MASK | inotify.IN_DELETE | inotify.IN_MOVED_FROM
+        #: The maximum number of untracked directories to watch
+        _MAX_NEW_DIRS = 4096
 
         def __init__(self, context, monitor):
             _BaseThread.__init__(self, context, monitor)
@@ -166,6 +206,9 @@ if AVAILABLE == 'inotify':
                 worktree = core.abspath(worktree)
             self._worktree = worktree
             self._git_dir = git.git_path()
+            self._root_dirs = set(
+                [worktree, self._git_dir, os.path.join(self._git_dir, 'refs')]
+            )
             self._lock = Lock()
             self._inotify_fd = None
             self._pipe_r = None
@@ -175,6 +218,8 @@ if AVAILABLE == 'inotify':
             self._git_dir_wd_to_path_map = {}
             self._git_dir_path_to_wd_map = {}
             self._git_dir_wd = None
+            self._new_worktree_dirs = set()
+            self._new_dirs_logged = False
 
         @staticmethod
         def _log_out_of_wds_message():
@@ -190,6 +235,18 @@ if AVAILABLE == 'inotify':
             )
             Interaction.log(msg)
 
+        def _log_new_dirs_not_watched_message(self):
+            if self._new_dirs_logged:
+                return
+            self._new_dirs_logged = True
+            msg = N_(
+                'File system change monitoring: some new directories are not'
+                ' watched because too many directories are already watched.'
+                '  Changes inside them are seen once they contain tracked'
+                ' files.\n'
+            )
+            Interaction.log(msg)
+
         def run(self):
             try:
                 with self._lock:
@@ -218,10 +275,7 @@ if AVAILABLE == 'inotify':
 
         def _process_events(self, poll_obj):
             while self._running:
-                if self._pending:
-                    timeout = self._NOTIFICATION_DELAY
-                else:
-                    timeout = None
+                timeout = self._notify_timeout()
                 try:
                     events = poll_obj.poll(timeout)
                 # pylint: disable=duplicate-except
@@ -233,9 +287,11 @@ if AVAILABLE == 'inotify':
                     if not events:
                         self.notify()
                     else:
+                        state = self._pending_state()
                         for (fd, _) in events:
                             if fd == self._inotify_fd:
                                 self._handle_events()
+                        self._schedule_notify(state)
 
         def _close_fds(self):
             with self._lock:
@@ -249,21 +305,44 @@ if AVAILABLE == 'inotify':
                     self._pipe_w = None
 
         def refresh(self):
+            # Nothing is watched before run() has opened the inotify fd
+            # or after stop(), so "git ls-files" is not needed then.
+            if self._inotify_fd is None or not self._running:
+                return
+            # "git ls-files" is run before taking the lock so that stop() and
+            # the monitor thread are only blocked while watches are updated.
+            if self._worktree is not None:
+                # The relative directories are joined with the worktree
+                # once per directory, not once per file.
+                worktree = self._worktree
+                tracked_dirs = set(
+                    [os.path.join(worktree, path) for path in self._tracked_dirs()]
+                )
+                tracked_dirs.add(worktree)
+            else:
+                tracked_dirs = None
+            if not self._running:
+                return
             with self._lock:
-                self._refresh()
+                self._refresh(tracked_dirs)
 
-        def _refresh(self):
+        def _refresh(self, tracked_dirs):
             if self._inotify_fd is None:
                 return
-            context = self.context
             try:
-                if self._worktree is not None:
-                    tracked_dirs = set(
+                if tracked_dirs is not None:
+                    # Keep watching directories that were created since the
+                    # last refresh so that their untracked files are noticed.
+                    # Directories that are now tracked no longer count
+                    # against _MAX_NEW_DIRS.
+                    self._new_worktree_dirs = set(
                         [
-                            os.path.dirname(os.path.join(self._worktree, path))
-                            for path in gitcmds.tracked_files(context)
+                            path
+                            for path in self._new_worktree_dirs
+                            if path not in tracked_dirs and core.isdir(path)
                         ]
                     )
+                    tracked_dirs.update(self._new_worktree_dirs)
                     self._refresh_watches(
                         tracked_dirs,
                         self._worktree_wd_to_path_map,
@@ -272,7 +351,7 @@ if AVAILABLE == 'inotify':
                 git_dirs = set()
                 git_dirs.add(self._git_dir)
                 for dirpath, _, _ in core.walk(os.path.join(self._git_dir, 'refs')):
-                    git_dirs.add(dirpath)
+                    git_dirs.add(core.decode(dirpath))
                 self._refresh_watches(
                     git_dirs, self._git_dir_wd_to_path_map, self._git_dir_path_to_wd_map
                 )
@@ -284,6 +363,38 @@ if AVAILABLE == 'inotify':
                 else:
                     raise
 
+        def _tracked_dirs(self):
+            """Return the relative directories that contain tracked files
+
+            The output of "git ls-files" is streamed and reduced to
+            directories as it is read so that the list of every tracked
+            file is never held in memory.
+
+            """
+            dirs = set()
+            # stderr is discarded rather than piped so that git can never
+            # block on a full stderr pipe while stdout is being read.
+            with open(os.devnull, 'wb') as devnull:
+                proc = core.start_command(
+                    ['git', 'ls-files', '-z'], cwd=self._worktree, stderr=devnull
+                )
+            proc.stdin.close()
+            null = bchr(0)
+            remainder = b''
+            for chunk in iter(lambda: proc.stdout.read(65536), b''):
+                if not self._running:
+                    # stop() was called, so the result is not needed
+                    proc.kill()
+                    break
+                paths = (remainder + chunk).split(null)
+                remainder = paths.pop()
+                for path in paths:
+                    dirs.add(os.path.dirname(path))
+            proc.stdout.close()
+            proc.wait()
+            dirs.discard(b'')
+            return set([core.decode(path) for path in dirs])
+
         def _refresh_watches(self, paths_to_watch, wd_to_path_map, path_to_wd_map):
             watched_paths = set(path_to_wd_map)
             for path in watched_paths - paths_to_watch:
@@ -299,55 +410,200 @@ if AVAILABLE == 'inotify':
                         continue
                     raise e
             for path in paths_to_watch - watched_paths:
-                try:
-                    wd = inotify.add_watch(
-                        self._inotify_fd, core.encode(path), self._ADD_MASK
+                # Adding many watches takes a while; stop() waits for the lock.
+                if not self._running:
+                    break
+                self._add_watch(path, wd_to_path_map, path_to_wd_map)
+
+        def _add_watch(self, path, wd_to_path_map, path_to_wd_map):
+            """Watch path and return its wd, or None when it is gone"""
+            if path in self._root_dirs:
+                mask = self._ADD_MASK
+            else:
+                mask = self._NOFOLLOW_ADD_MASK
+            try:
+                wd = inotify.add_watch(self._inotify_fd, core.encode(path), mask)
+            except OSError as e:
+                if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                    # These two errors should only occur as a result of
+                    # race conditions:  the first if the directory
+                    # referenced by path was removed or renamed before the
+                    # call to inotify.add_watch(); the second if the
+                    # directory referenced by path was replaced with a file
+                    # before the call to inotify.add_watch().  Therefore we
+                    # simply ignore them.
+                    return None
+                raise e
+            else:
+                # inotify_add_watch() returns the existing wd when a watched
+                # directory was renamed, so forget the path it had before.
+                old_path = wd_to_path_map.get(wd)
+                if old_path is not None and old_path != path:
+                    path_to_wd_map.pop(old_path, None)
+                wd_to_path_map[wd] = path
+                path_to_wd_map[path] = wd
+                return wd
+
+        def _watch_new_directories(self, new_dirs):
+            """Watch directories that were added inside of watched directories
+
+            Only directories containing tracked files are watched by
+            refresh(), so new worktree directories and their subdirectories
+            are added here as they appear.  New directories below refs/
+            are added so that changes to "feature/x" branches are seen.
+            new_dirs holds the (wd, name) pairs from one batch of events.
+
+            """
+            git_dirs = []
+            worktree_dirs = []
+            for wd, name in new_dirs:
+                name = core.decode(name)
+                if wd in self._git_dir_wd_to_path_map and wd != self._git_dir_wd:
+                    parent = self._git_dir_wd_to_path_map[wd]
+                    git_dirs.append(os.path.join(parent, name))
+                elif wd in self._worktree_wd_to_path_map and name != '.git':
+                    parent = self._worktree_wd_to_path_map[wd]
+                    worktree_dirs.append(os.path.join(parent, name))
+            if worktree_dirs:
+                # The new directories are walked and filtered before taking
+                # the lock so that stop() and refresh() are not kept waiting.
+                worktree_dirs = self._new_worktree_dirs_to_watch(worktree_dirs)
+            with self._lock:
+                self._add_new_watches(
+                    git_dirs, self._git_dir_wd_to_path_map, self._git_dir_path_to_wd_map
+                )
+                self._new_worktree_dirs.update(
+                    self._add_new_watches(
+                        worktree_dirs,
+                        self._worktree_wd_to_path_map,
+                        self._worktree_path_to_wd_map,
                     )
+                )
+
+        def _add_new_watches(self, paths, wd_to_path_map, path_to_wd_map):
+            """Watch new directories and return the paths that were added"""
+            added = []
+            for path in paths:
+                if not self._running:
+                    break
+                try:
+                    wd = self._add_watch(path, wd_to_path_map, path_to_wd_map)
                 except OSError as e:
-                    if e.errno in (errno.ENOENT, errno.ENOTDIR):
-                        # These two errors should only occur as a result of
-                        # race conditions:  the first if the directory
-                        # referenced by path was removed or renamed before the
-                        # call to inotify.add_watch(); the second if the
-                        # directory referenced by path was replaced with a file
-                        # before the call to inotify.add_watch().  Therefore we
-                        # simply ignore them.
+                    if e.errno in (errno.EACCES, errno.ELOOP):
+                        # Unreadable directories are left unwatched
                         continue
-                    raise e
-                else:
-                    wd_to_path_map[wd] = path
-                    path_to_wd_map[path] = wd
+                    if e.errno in (errno.ENOSPC, errno.EMFILE):
+                        # Keep the existing watches; only the new
+                        # directories are left unwatched.
+                        self._log_new_dirs_not_watched_message()
+                        break
+                    raise
+                if wd is not None:
+                    added.append(path)
+            return added
+
+        def _new_worktree_dirs_to_watch(self, paths):
+            """Return the directories to watch for new worktree directories
+
+            The directories are walked one level at a time, with a single
+            "git check-ignore" run per level, so that ignored directories
+            (e.g. "node_modules/") are skipped without being walked.
+            Symlinks are not followed.  At most _MAX_NEW_DIRS new
+            directories are watched.
+
+            """
+            dirs = []
+            limit = self._MAX_NEW_DIRS - len(self._new_worktree_dirs)
+            level = paths
+            while level and len(dirs) < limit and self._running:
+                level = self._filter_ignored(level)[: limit - len(dirs)]
+                dirs.extend(level)
+                subdirs = []
+                for dirpath in level:
+                    for _, dirnames, _ in core.walk(dirpath):
+                        for dirname in dirnames:
+                            dirname = core.decode(dirname)
+                            subdir = os.path.join(dirpath, dirname)
+                            # Symlinks to directories would be walked and
+                            # watched again through the link, or forever
+                            # for links such as "up -> ..".
+                            if dirname != '.git' and not core.islink(subdir):
+                                subdirs.append(subdir)
+                        break
+                level = subdirs
+            if level and len(dirs) >= limit:
+                self._log_new_dirs_not_watched_message()
+            return dirs
+
+        def _filter_ignored(self, dirs):
+            """Return the directories that are not ignored by git"""
+            if not self._use_check_ignore:
+                return dirs
+            # The trailing slash lets "git check-ignore" match directory
+            # patterns such as "build/".
+            encoded_dirs = [core.encode(path + '/') for path in dirs]
+            proc = core.start_command(
+                ['git', 'check-ignore', '-z', '--stdin'], cwd=self._worktree
+            )
+            out, _ = proc.communicate(bchr(0).join(encoded_dirs))
+            # "git check-ignore" exits with 1 when nothing is ignored
+            if proc.returncode not in (0, 1):
+                return dirs
+            ignored = set(out.split(bchr(0)))
+            return [
+                path
+                for path, encoded in zip(dirs, encoded_dirs)
+                if encoded not in ignored
+            ]
 
         def _check_event(self, wd, mask, name):
             if mask & inotify.IN_Q_OVERFLOW:
                 self._force_notify = True
             elif not mask & self._TRIGGER_MASK:
                 pass
-            elif mask & inotify.IN_ISDIR:
+            elif mask & inotify.IN_ISDIR and not mask & self._DIR_TRIGGER_MASK:
                 pass
             elif wd in self._worktree_wd_to_path_map:
                 if self._use_check_ignore and name:
-                    path = os.path.join(
-                        self._worktree_wd_to_path_map[wd], core.decode(name)
-                    )
+                    # Watched paths are absolute and normalized, so plain
+                    # concatenation is equivalent to os.path.join() here.
+                    path = self._worktree_wd_to_path_map[wd] + '/' + core.decode(name)
+                    if mask & inotify.IN_ISDIR:
+                        # The trailing slash lets "git check-ignore" match
+                        # directory patterns for directories that are gone.
+                        path += '/'
                     self._file_paths.add(path)
                 else:
                     self._force_notify = True
+            elif not name:
+                pass
+            # Names inside the git directory are compared as bytes to avoid
+            # decoding the names of the many "*.lock" files git creates.
             elif wd == self._git_dir_wd:
-                name = core.decode(name)
-                if name in ('HEAD', 'index'):
+                if name in (b'HEAD', b'index'):
                     self._force_notify = True
-                elif name == 'config':
+                elif name == b'config':
                     self._force_config = True
-            elif wd in self._git_dir_wd_to_path_map and not core.decode(name).endswith(
-                '.lock'
-            ):
+            elif wd in self._git_dir_wd_to_path_map and not name.endswith(b'.lock'):
                 self._force_notify = True
 
         def _handle_events(self):
+            # Writing a single file produces several events (IN_CREATE,
+            # IN_MODIFY, IN_CLOSE_WRITE, ...) so the masks for each name are
+            # merged and every name is checked only once per batch.
+            events = {}
+            new_dirs = []
             for wd, mask, _, name in inotify.read_events(self._inotify_fd):
-                if not self._force_notify:
-                    self._check_event(wd, mask, name)
+                if mask & inotify.IN_ISDIR and mask & self._NEW_DIR_MASK:
+                    new_dirs.append((wd, name))
+                key = (wd, name, mask & inotify.IN_ISDIR)
+                events[key] = events.get(key, 0) | mask
+            if new_dirs:
+                self._watch_new_directories(new_dirs)
+            for (wd, name, _), mask in events.items():
+                if self._force_notify:
+                    break
+                self._check_event(wd, mask, name)
 
         def stop(self):
             self._running = False
@@ -360,8 +616,15 @@ if AVAILABLE == 'inotify':
 if AVAILABLE == 'pywin32':
 
     class _Win32Watch(object):
-        def __init__(self, path, flags):
+        #: ReadDirectoryChangesW() does not support buffers larger than 64KiB
+        #: for directories on network shares.
+        _BUFFER_SIZE = 65536
+        # constant from winerror.h
+        _ERROR_NOTIFY_ENUM_DIR = 1022
+
+        def __init__(self, path, flags, recursive=True):
             self.flags = flags
+            self.recursive = recursive
 
             self.handle = None
             self.event = None
@@ -377,7 +640,13 @@ if AVAILABLE == 'pywin32':
                     None,
                 )
 
-                self.buffer = win32file.AllocateReadBuffer(8192)
+                # Two buffers are used so that the next read can be queued
+                # before the results of the previous one are parsed.
+                self.buffers = [
+                    win32file.AllocateReadBuffer(self._BUFFER_SIZE),
+                    win32file.AllocateReadBuffer(self._BUFFER_SIZE),
+                ]
+                self.buffer_index = 0
                 self.event = win32event.CreateEvent(None, True, False, None)
                 self.overlapped = pywintypes.OVERLAPPED()
                 self.overlapped.hEvent = self.event
@@ -388,18 +657,39 @@ if AVAILABLE == 'pywin32':
 
         def _start(self):
             win32file.ReadDirectoryChangesW(
-                self.handle, self.buffer, True, self.flags, self.overlapped
+                self.handle,
+                self.buffers[self.buffer_index],
+                self.recursive,
+                self.flags,
+                self.overlapped,
             )
 
         def read(self):
+            """Return the (action, path) changes reported by the last read
+
+            None is returned when more changes happened than the buffer
+            could hold and the individual changes were discarded.
+
+            """
             if win32event.WaitForSingleObject(self.event, 0) == win32event.WAIT_TIMEOUT:
                 result = []
             else:
-                nbytes = win32file.GetOverlappedResult(
-                    self.handle, self.overlapped, False
-                )
-                result = win32file.FILE_NOTIFY_INFORMATION(self.buffer, nbytes)
+                try:
+                    nbytes = win32file.GetOverlappedResult(
+                        self.handle, self.overlapped, False
+                    )
+                except pywintypes.error as e:
+                    if e.winerror != self._ERROR_NOTIFY_ENUM_DIR:
+                        raise
+                    nbytes = 0
+                buf = self.buffers[self.buffer_index]
+                self.buffer_index = 1 - self.buffer_index
                 self._start()
+                if nbytes:
+                    result = win32file.FILE_NOTIFY_INFORMATION(buf, nbytes)
+                else:
+                    # The buffer overflowed
+                    result = None
             return result
 
         def close(self):
@@ -418,6 +708,14 @@ if AVAILABLE == 'pywin32':
             | win32con.FILE_NOTIFY_CHANGE_LAST_WRITE
             | win32con.FILE_NOTIFY_CHANGE_SECURITY
         )
+        # FILE_ACTION_REMOVED and FILE_ACTION_RENAMED_OLD_NAME from winnt.h
+        _REMOVED_ACTIONS = (0x00000002, 0x00000004)
+        # FILE_ACTION_MODIFIED from winnt.h
+        _MODIFIED_ACTION = 0x00000003
+        #: The maximum number of paths remembered by _is_dir()
+        _MAX_CACHED_PATHS = 65536
+        # Matches ".git" path components, including nested repositories
+        _GIT_PATH_RE = re.compile(r'(?:^|/)\.git(?:/|$)')
 
         def __init__(self, context, monitor):
             _BaseThread.__init__(self, context, monitor)
@@ -429,8 +727,10 @@ if AVAILABLE == 'pywin32':
             self._worktree_watch = None
             self._git_dir = self._transform_path(core.abspath(git.git_path()))
             self._git_dir_watch = None
+            self._refs_watch = None
             self._stop_event_lock = Lock()
             self._stop_event = None
+            self._is_dir_cache = {}
 
         @staticmethod
         def _transform_path(path):
@@ -447,15 +747,21 @@ if AVAILABLE == 'pywin32':
                     self._worktree_watch = _Win32Watch(self._worktree, self._FLAGS)
                     events.append(self._worktree_watch.event)
 
-                self._git_dir_watch = _Win32Watch(self._git_dir, self._FLAGS)
+                # Only the top of the git directory and refs/ are watched so
+                # that writes to objects/ and logs/ are never reported.
+                self._git_dir_watch = _Win32Watch(self._git_dir, self._FLAGS, False)
                 events.append(self._git_dir_watch.event)
 
+                refs_dir = self._git_dir + '/refs'
+                if core.isdir(refs_dir):
+                    self._refs_watch = _Win32Watch(refs_dir, self._FLAGS)
+                    events.append(self._refs_watch.event)
+
                 self._log_enabled_message()
 
                 while self._running:
-                    if self._pending:
-                        timeout = self._NOTIFICATION_DELAY
-                    else:
+                    timeout = self._notify_timeout()
+                    if timeout is None:
                         timeout = win32event.INFINITE
                     rc = win32event.WaitForMultipleObjects(events, False, timeout)
                     if not self._running:
@@ -463,7 +769,9 @@ if AVAILABLE == 'pywin32':
                     if rc == win32event.WAIT_TIMEOUT:
                         self.notify()
                     else:
+                        state = self._pending_state()
                         self._handle_results()
+                        self._schedule_notify(state)
             finally:
                 with self._stop_event_lock:
                     if self._stop_event is not None:
@@ -473,37 +781,95 @@ if AVAILABLE == 'pywin32':
                     self._worktree_watch.close()
                 if self._git_dir_watch is not None:
                     self._git_dir_watch.close()
+                if self._refs_watch is not None:
+                    self._refs_watch.close()
+
+        def _read_watch(self, watch):
+            results = watch.read()
+            if results is None:
+                # Changes were lost, so refresh everything
+                self._force_notify = True
+                self._is_dir_cache.clear()
+                results = []
+            return results
+
+        def _is_dir(self, path, action):
+            """Return True when path is a directory
+
+            A path can only change between being a file and a directory
+            by being removed and added again, so modifications are answered
+            from the results remembered for earlier changes.
+
+            Only the directory itself is reported when it is added, removed
+            or renamed, not the paths below it, so the whole cache is
+            dropped then.  It is also dropped once it holds
+            _MAX_CACHED_PATHS entries.
+
+            """
+            cache = self._is_dir_cache
+            if action == self._MODIFIED_ACTION:
+                try:
+                    return cache[path]
+                except KeyError:
+                    pass
+            is_dir = os.path.isdir(path)
+            if is_dir and action != self._MODIFIED_ACTION:
+                cache.clear()
+            elif len(cache) >= self._MAX_CACHED_PATHS:
+                cache.clear()
+            cache[path] = is_dir
+            return is_dir
 
         def _handle_results(self):
+            # The checks below are repeated for every changed path, so the
+            # values that stay constant across a batch are looked up once.
+            transform_path = self._transform_path
+            git_dir = self._git_dir
+            git_dir_prefix = git_dir + '/'
             if self._worktree_watch is not None:
-                for _, path in self._worktree_watch.read():
+                worktree_prefix = self._worktree + '/'
+                for action, path in self._read_watch(self._worktree_watch):
                     if not self._running:
                         break
                     if self._force_notify:
+                        # The remaining changes are not seen by _is_dir()
+                        self._is_dir_cache.clear()
+                        break
+                    path = transform_path(path)
+                    if self._GIT_PATH_RE.search(path):
                         continue
-                    path = self._worktree + '/' + self._transform_path(path)
-                    if (
-                        path != self._git_dir
-                        and not path.startswith(self._git_dir + '/')
-                        and not os.path.isdir(path)
-                    ):
-                        if self._use_check_ignore:
-                            self._file_paths.add(path)
-                        else:
-                            self._force_notify = True
-            for _, path in self._git_dir_watch.read():
-                if not self._running:
+                    path = worktree_prefix + path
+                    if path == git_dir or path.startswith(git_dir_prefix):
+                        continue
+                    # Removed paths no longer exist so they need no stat().
+                    if action in self._REMOVED_ACTIONS:
+                        # A removed path that was not known to be a file
+                        # may have been a directory.
+                        if self._is_dir_cache.pop(path, True):
+                            self._is_dir_cache.clear()
+                    elif self._is_dir(path, action):
+                        continue
+                    if self._use_check_ignore:
+                        self._file_paths.add(path)
+                    else:
+                        self._force_notify = True
+            for _, path in self._read_watch(self._git_dir_watch):
+                if not self._running or self._force_notify:
                     break
-                if self._force_notify:
-                    continue
-                path = self._transform_path(path)
+                path = transform_path(path)
                 if path.endswith('.lock'):
                     continue
                 if path == 'config':
                     self._force_config = True
                     continue
-                if path == 'head' or path == 'index' or path.startswith('refs/'):
+                if path == 'head' or path == 'index':
                     self._force_notify = True
+            if self._refs_watch is not None:
+                for _, path in self._read_watch(self._refs_watch):
+                    if not self._running or self._force_notify:
+                        break
+                    if not transform_path(path).endswith('.lock'):
+                        self._force_notify = True
 
         def stop(self):
             self._running = False
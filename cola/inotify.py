@@ -3,6 +3,7 @@ import ctypes
 import ctypes.util
 import errno
 import os
+import struct
 
 # constant from Linux include/uapi/linux/limits.h
 NAME_MAX = 255
@@ -19,8 +20,11 @@ IN_DELETE = 0x00000200
 IN_Q_OVERFLOW = 0x00004000
 
 IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
 IN_EXCL_UNLINK = 0x04000000
-IN_ISDIR = 0x80000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
 
 
 class inotify_event(ctypes.Structure):
@@ -34,6 +38,10 @@ class inotify_event(ctypes.Structure):
 
 MAX_EVENT_SIZE = ctypes.sizeof(inotify_event) + NAME_MAX + 1
 
+# Unpacks the fixed-size header of an inotify_event without creating a
+# ctypes object for every event.
+_event_header = struct.Struct(str('iIII'))
+
 
 def _errcheck(result, func, arguments):
     if result >= 0:
@@ -47,18 +55,28 @@ def _errcheck(result, func, arguments):
 try:
     _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
     _read = _libc.read
-    init = _libc.inotify_init
+    _init = _libc.inotify_init
     add_watch = _libc.inotify_add_watch
     rm_watch = _libc.inotify_rm_watch
 except AttributeError:
     raise ImportError('Could not load inotify functions from libc')
 
+try:
+    # inotify_init1() was added in Linux 2.6.27 and glibc 2.9
+    _init1 = _libc.inotify_init1
+except AttributeError:
+    _init1 = None
+
 
 _read.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t]
 _read.errcheck = _errcheck
 
-init.argtypes = []
-init.errcheck = _errcheck
+_init.argtypes = []
+_init.errcheck = _errcheck
+
+if _init1 is not None:
+    _init1.argtypes = [ctypes.c_int]
+    _init1.errcheck = _errcheck
 
 add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
 add_watch.errcheck = _errcheck
@@ -67,21 +85,25 @@ rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
 rm_watch.errcheck = _errcheck
 
 
+def init():
+    """Create an inotify instance that is not inherited by child processes"""
+    if _init1 is not None:
+        return _init1(IN_CLOEXEC)
+    return _init()
+
+
 def read_events(inotify_fd, count=64):
     buf = ctypes.create_string_buffer(MAX_EVENT_SIZE * count)
     n = _read(inotify_fd, buf, ctypes.sizeof(buf))
 
-    addr = ctypes.addressof(buf)
-    while n:
-        assert n >= ctypes.sizeof(inotify_event)
-        event = inotify_event.from_address(addr)
-        addr += ctypes.sizeof(inotify_event)
-        n -= ctypes.sizeof(inotify_event)
-        if event.len:
-            assert n >= event.len
-            name = ctypes.string_at(addr)
-            addr += event.len
-            n -= event.len
+    offset = 0
+    while offset < n:
+        wd, mask, cookie, length = _event_header.unpack_from(buf, offset)
+        offset += _event_header.size
+        if length:
+            # The name is padded with null bytes up to "length"
+            name = buf[offset : offset + length].rstrip(b'\0')
+            offset += length
         else:
             name = None
-        yield event.wd, event.mask, event.cookie, name
+        yield wd, mask, cookie, name
@@ -0,0 +1,225 @@
+from __future__ import absolute_import, division, unicode_literals
+import errno
+import os
+import select
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from cola import core
+from cola import fsmonitor
+from cola.compat import bchr
+
+from . import helper
+
+
+class BaseThreadTestCase(helper.GitRepositoryTestCase):
+    """Tests the notification deadline of fsmonitor._BaseThread"""
+
+    def test_deadline_moves_only_for_new_changes(self):
+        thread = fsmonitor._BaseThread(self.context, mock.Mock())
+        state = thread._pending_state()
+        thread._schedule_notify(state)
+        self.assertIsNone(thread._notify_deadline)
+
+        state = thread._pending_state()
+        thread._file_paths.add('a')
+        thread._schedule_notify(state)
+        deadline = thread._notify_deadline
+        self.assertIsNotNone(deadline)
+
+        # A batch that repeats a pending path does not postpone notify()
+        state = thread._pending_state()
+        thread._file_paths.add('a')
+        thread._schedule_notify(state)
+        self.assertEqual(deadline, thread._notify_deadline)
+
+
+@unittest.skipIf(fsmonitor.AVAILABLE != 'inotify', 'inotify is not available')
+class InotifyThreadTestCase(helper.GitRepositoryTestCase):
+    """Tests the events seen by fsmonitor._InotifyThread"""
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        os.makedirs(os.path.join('a', 's'))
+        self.touch(os.path.join('a', 'f'), os.path.join('a', 's', 'f'))
+        self.run_git('add', '.')
+        self.commit_files()
+        self.outside = tempfile.mkdtemp('_cola_test')
+
+        self.thread = fsmonitor._InotifyThread(self.context, mock.Mock())
+        self.thread._inotify_fd = fsmonitor.inotify.init()
+        self.thread.refresh()
+
+    def tearDown(self):
+        os.close(self.thread._inotify_fd)
+        shutil.rmtree(self.outside)
+        helper.GitRepositoryTestCase.tearDown(self)
+
+    def worktree_path(self, *paths):
+        return os.path.join(self.thread._worktree, *paths)
+
+    def handle_events(self):
+        """Process every queued inotify event"""
+        fd = self.thread._inotify_fd
+        while select.select([fd], [], [], 0)[0]:
+            self.thread._handle_events()
+
+    def test_directory_moved_into_worktree(self):
+        os.mkdir(os.path.join(self.outside, 'new'))
+        os.rename(os.path.join(self.outside, 'new'), os.path.join('a', 'new'))
+        self.handle_events()
+        self.assertIn(self.worktree_path('a', 'new') + '/', self.thread._file_paths)
+
+    def test_tracked_directory_moved_out_of_worktree(self):
+        os.rename(os.path.join('a', 's'), os.path.join(self.outside, 's'))
+        self.handle_events()
+        self.assertIn(self.worktree_path('a', 's') + '/', self.thread._file_paths)
+
+    def test_paths_follow_a_renamed_directory(self):
+        self.touch(os.path.join('a', 'x'))
+        self.handle_events()
+        os.rename('a', 'b')
+        self.handle_events()
+        self.thread._force_notify = False
+        self.thread._file_paths = set()
+
+        self.touch(os.path.join('b', 'new'))
+        self.handle_events()
+        self.assertIn(self.worktree_path('b', 'new'), self.thread._file_paths)
+
+    def test_renamed_directory_is_watched_after_refresh(self):
+        os.rename('a', 'b')
+        self.handle_events()
+        self.run_git('add', '--all')
+        self.run_git('commit', '-m', 'rename a to b')
+        self.thread.refresh()
+        self.handle_events()
+        self.thread._force_notify = False
+        self.thread._file_paths = set()
+
+        self.touch(os.path.join('b', 'new'))
+        self.handle_events()
+        self.assertIn(self.worktree_path('b', 'new'), self.thread._file_paths)
+
+    def test_new_directories_are_watched(self):
+        os.makedirs(os.path.join('a', 'new', 'sub'))
+        self.handle_events()
+        watched = self.thread._worktree_path_to_wd_map
+        self.assertIn(self.worktree_path('a', 'new'), watched)
+        self.assertIn(self.worktree_path('a', 'new', 'sub'), watched)
+
+    def test_new_directories_are_filtered_once_per_level(self):
+        for i in range(5):
+            os.makedirs(os.path.join('a', 'new%d' % i, 'sub'))
+        filter_ignored = self.thread._filter_ignored
+        with mock.patch.object(
+            self.thread, '_filter_ignored', side_effect=filter_ignored
+        ) as mock_filter_ignored:
+            self.handle_events()
+        self.assertEqual(2, mock_filter_ignored.call_count)
+        watched = self.thread._worktree_path_to_wd_map
+        for i in range(5):
+            self.assertIn(self.worktree_path('a', 'new%d' % i, 'sub'), watched)
+
+    def test_ignored_new_directory_is_not_watched(self):
+        self.write_file('.gitignore', 'build/\n')
+        os.makedirs(os.path.join('a', 'build', 'sub'))
+        self.handle_events()
+        watched = self.thread._worktree_path_to_wd_map
+        self.assertNotIn(self.worktree_path('a', 'build'), watched)
+        self.assertNotIn(self.worktree_path('a', 'build', 'sub'), watched)
+
+    def test_symlinked_new_directories_are_not_followed(self):
+        venv = os.path.join(self.outside, 'venv')
+        os.makedirs(os.path.join(venv, 'lib', 'py'))
+        os.symlink('lib', os.path.join(venv, 'lib64'))
+        os.symlink('..', os.path.join(venv, 'lib', 'up'))
+        os.rename(venv, os.path.join('a', 'venv'))
+        self.handle_events()
+
+        watched = self.thread._worktree_path_to_wd_map
+        lib_py = self.worktree_path('a', 'venv', 'lib', 'py')
+        self.assertIn(lib_py, watched)
+        self.assertEqual(lib_py, self.thread._worktree_wd_to_path_map[watched[lib_py]])
+        for path in watched:
+            self.assertNotIn('lib64', path)
+            self.assertNotIn('up', path.split(os.sep))
+
+    def test_unreadable_new_directory(self):
+        add_watch = fsmonitor.inotify.add_watch
+        denied = core.encode(self.worktree_path('a', 'denied'))
+
+        def add_watch_or_deny(fd, path, mask):
+            if path == denied:
+                raise OSError(errno.EACCES, os.strerror(errno.EACCES))
+            return add_watch(fd, path, mask)
+
+        os.mkdir(os.path.join('a', 'denied'))
+        os.mkdir(os.path.join('a', 'new'))
+        with mock.patch.object(fsmonitor.inotify, 'add_watch', add_watch_or_deny):
+            self.handle_events()
+        watched = self.thread._worktree_path_to_wd_map
+        self.assertNotIn(self.worktree_path('a', 'denied'), watched)
+        self.assertIn(self.worktree_path('a', 'new'), watched)
+        self.assertTrue(self.thread._running)
+
+    def test_new_directory_limit(self):
+        self.thread._MAX_NEW_DIRS = 1
+        os.makedirs(os.path.join('a', 'new', 'sub'))
+        self.handle_events()
+        watched = self.thread._worktree_path_to_wd_map
+        self.assertIn(self.worktree_path('a', 'new'), watched)
+        self.assertNotIn(self.worktree_path('a', 'new', 'sub'), watched)
+        self.assertTrue(self.thread._running)
+
+    def test_tracked_new_directory_does_not_count_against_limit(self):
+        os.mkdir(os.path.join('a', 'new'))
+        self.handle_events()
+        self.assertIn(self.worktree_path('a', 'new'), self.thread._new_worktree_dirs)
+
+        self.touch(os.path.join('a', 'new', 'f'))
+        self.run_git('add', '.')
+        self.run_git('commit', '-m', 'add a/new')
+        self.thread.refresh()
+        self.assertEqual(set(), self.thread._new_worktree_dirs)
+        watched = self.thread._worktree_path_to_wd_map
+        self.assertIn(self.worktree_path('a', 'new'), watched)
+
+    def test_vanished_new_directory_is_not_remembered(self):
+        wd = self.thread._worktree_path_to_wd_map[self.thread._worktree]
+        self.thread._watch_new_directories([(wd, b'gone')])
+        self.assertEqual(set(), self.thread._new_worktree_dirs)
+
+    def test_tracked_dirs_across_read_boundary(self):
+        # "git ls-files" output is read in 64 KiB chunks.  Each entry below
+        # is 156 bytes, so one of them is split between two reads.
+        blob = self.run_git('hash-object', '-w', 'A').strip()
+        dirs = ['%03d%s' % (i, 'd' * 150) for i in range(500)]
+        args = []
+        for dirname in dirs:
+            args.extend(['--cacheinfo', '100644,%s,%s/f' % (blob, dirname)])
+        self.run_git('update-index', '--add', *args)
+        out = core.encode(self.run_git('ls-files', '-z'))
+        self.assertGreater(len(out), 65536)
+        self.assertNotIn(bchr(0), out[65535:65537])
+
+        expect = set(dirs + ['a', os.path.join('a', 's')])
+        self.assertEqual(expect, self.thread._tracked_dirs())
+
+    def test_refresh_before_run(self):
+        thread = fsmonitor._InotifyThread(self.context, mock.Mock())
+        with mock.patch.object(thread, '_tracked_dirs') as tracked_dirs:
+            thread.refresh()
+        self.assertFalse(tracked_dirs.called)
+
+    def test_new_ref_directory(self):
+        self.run_git('branch', 'feature/x')
+        self.handle_events()
+        self.assertTrue(self.thread._force_notify)
+
+
+if __name__ == '__main__':
+    unittest.main()
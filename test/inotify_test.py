@@ -0,0 +1,48 @@
+from __future__ import absolute_import, division, unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+
+from cola import core
+from cola import fsmonitor
+
+
+@unittest.skipIf(fsmonitor.AVAILABLE != 'inotify', 'inotify is not available')
+class InotifyTestCase(unittest.TestCase):
+    """Tests the inotify module"""
+
+    def setUp(self):
+        self.inotify = fsmonitor.inotify
+        self.path = tempfile.mkdtemp('_cola_test')
+        self.fd = self.inotify.init()
+
+    def tearDown(self):
+        os.close(self.fd)
+        shutil.rmtree(self.path)
+
+    def test_read_events(self):
+        inotify = self.inotify
+        mask = inotify.IN_CREATE | inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO
+        wd = inotify.add_watch(self.fd, core.encode(self.path), mask)
+
+        filename = os.path.join(self.path, 'file')
+        with open(filename, 'w'):
+            pass
+        os.rename(filename, os.path.join(self.path, 'renamed-file'))
+
+        # The kernel pads each name with null bytes, which are stripped
+        events = [
+            (event_wd, event_mask, name)
+            for event_wd, event_mask, _, name in inotify.read_events(self.fd)
+        ]
+        expect = [
+            (wd, inotify.IN_CREATE, b'file'),
+            (wd, inotify.IN_MOVED_FROM, b'file'),
+            (wd, inotify.IN_MOVED_TO, b'renamed-file'),
+        ]
+        self.assertEqual(expect, events)
+
+
+if __name__ == '__main__':
+    unittest.main()